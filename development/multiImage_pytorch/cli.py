@@ -18,6 +18,10 @@ def parse_args():
                         type=int,
                         help='Number of input images (i.e., photographs of the material patch) in the input dataset.')
 
+    parser.add_argument('--input-memmap', dest='input_memmap', action='store',
+                        default=None,
+                        help='Memory-mapped file with the pre-decoded input data (created by running dataset.py on the input directory).')
+
     parser.add_argument('--linear-input', dest='linear_input', action='store_true',
                         default=False,
                         help='Flag to indicate that the input images are already in linear RGB.')
@@ -42,6 +46,14 @@ def parse_args():
                         default=False,
                         help='Add spatial image coordinates as features.')
 
+    parser.add_argument('--mixed-precision', dest='mixed_precision', action='store',
+                        choices=['no', 'fp16', 'bf16'], default='no',
+                        help='Precision used for the forward pass of the model during training (bf16 requires a GPU with bf16 support). Default is %(default)s.')
+
+    parser.add_argument('--compile', dest='compile', action='store_true',
+                        default=False,
+                        help='Compile the model (and the local renderer of the loss) with torch.compile. The first steps take considerably longer but the following steps run faster.')
+
     parser.add_argument('--omit-optimizer-state-save', dest='omit_optimizer_state_save', action='store_true',
                         default=False,
                         help='Do not store the optimizer state in the checkpoint. Setting this option reduces checkpoint size but can impact training continuation negatively.')
@@ -57,6 +69,10 @@ def parse_args():
                         type=int, default=0,
                         help='Id of the GPU to use. If it is < 0, the CPU is used.')
 
+    parser.add_argument('--num-workers', '-w', dest='num_workers', action='store', required=False,
+                        type=int, default=8,
+                        help='Number of worker processes used for loading the data. If it is 0, the data is loaded in the main process. Default is %(default)s.')
+
     parser.add_argument('--save-frequency', dest='save_frequency', action='store', required=False,
                         type=int, choices=range(1, 1000), default=50,
                         metavar="[0-1000]",
@@ -1,9 +1,9 @@
 import environment as env
 from PIL import Image
-import matplotlib.pyplot as plt
 import math
 import os
 import numpy as np
+import random
 import renderers
 import torch
 import utils
@@ -13,9 +13,9 @@ class SvbrdfDataset(torch.utils.data.Dataset):
     Class representing a collection of SVBRDF samples with corresponding input images (rendered or real views of the SVBRDF)
     """
 
-    def __init__(self, data_directory, image_size, scale_mode, input_image_count, used_input_image_count, use_augmentation, mix_materials=False, no_svbrdf=False, is_linear=False, random_crop=False):
+    def __init__(self, data_directory, image_size, scale_mode, input_image_count, used_input_image_count, use_augmentation, mix_materials=False, no_svbrdf=False, is_linear=False, random_crop=False, defer_processing=False, memmap_path=None):
         self.data_directory = data_directory
-        self.file_paths = [os.path.join(data_directory, f) for f in os.listdir(data_directory) if os.path.isfile(os.path.join(data_directory, f))]
+        self.file_paths     = utils.list_files(data_directory)
 
         self.image_size             = image_size
         self.scale_mode             = scale_mode
@@ -39,6 +39,21 @@ class SvbrdfDataset(torch.utils.data.Dataset):
         # If scale mode is 'crop', crop out a randomly placed window from the image
         self.random_crop = random_crop
 
+        # If processing is deferred, the samples only carry the raw (uint8) input images and the parameters of the scenes for the generated input images.
+        # The images are then decoded and rendered for the whole batch at once in postprocess_batch(), e.g., on the GPU.
+        self.defer_processing = defer_processing
+
+        # The samples can be read from a memory-mapped file with the pre-decoded images (see build_memmap()) instead of the image files.
+        # The file is only opened on first access, so that every worker process maps it on its own.
+        self.memmap_path = memmap_path
+        self.memmap      = None
+
+    def __getstate__(self):
+        # Never pickle the mapped memory (e.g., when spawning the worker processes)
+        state = self.__dict__.copy()
+        state['memmap'] = None
+        return state
+
     def __len__(self):
         return len(self.file_paths)
 
@@ -46,13 +61,16 @@ class SvbrdfDataset(torch.utils.data.Dataset):
         if torch.is_tensor(idx):
             idx = idx.tolist()
 
-        input_images, svbrdf = self.read_sample(self.file_paths[idx])
+        input_images, svbrdf = self.read_sample(idx)
 
+        # With deferred processing, the materials are mixed for the whole batch at once (after cropping)
+        other_svbrdf = None
         if self.mix_materials:
-            import random
-            other_index     = random.randrange(0, self.__len__())
-            _, other_svbrdf = self.read_sample(self.file_paths[other_index])
-            svbrdf          = self.mix(svbrdf, other_svbrdf)
+            other_index     = int(get_rng().integers(0, len(self)))
+            _, other_svbrdf = self.read_sample(other_index)
+            if not self.defer_processing:
+                svbrdf       = self.mix(svbrdf, other_svbrdf)
+                other_svbrdf = None
 
         if self.scale_mode == 'resize':
             width  = input_images.shape[-1]
@@ -60,16 +78,25 @@ class SvbrdfDataset(torch.utils.data.Dataset):
 
             # Crop out the center of the sample
             is_landscape = width > height
-            crop_anchor  = torch.IntTensor([0, (width - height) // 2]) if is_landscape else torch.IntTensor([(height - width) // 2, 0])
+            crop_anchor  = (0, (width - height) // 2) if is_landscape else ((height - width) // 2, 0)
             crop_size    = height if is_landscape else width
 
             input_images = utils.crop_square(input_images, crop_anchor, crop_size)
             svbrdf       = utils.crop_square(svbrdf, crop_anchor, crop_size)
+            if other_svbrdf is not None:
+                other_svbrdf = utils.crop_square(other_svbrdf, crop_anchor, crop_size)
+
+            # Interpolation requires floating point images
+            input_images = utils.convert_to_float(input_images)
 
             # Scale the images and the SVBRDF down to the desired size
             # Note: Do not use bicubic interpolation, as it might produce negative values or values > 1 which requires clamping
-            input_images = torch.nn.functional.interpolate(input_images,        size=(self.image_size, self.image_size), mode='bilinear')
-            svbrdf       = torch.nn.functional.interpolate(svbrdf.unsqueeze(0), size=(self.image_size, self.image_size), mode='bilinear').squeeze(0)
+            #       Area interpolation is cheaper and properly filters when scaling down.
+            interpolation_mode = 'area' if crop_size >= self.image_size else 'bilinear'
+            input_images = torch.nn.functional.interpolate(input_images,        size=(self.image_size, self.image_size), mode=interpolation_mode)
+            svbrdf       = torch.nn.functional.interpolate(svbrdf.unsqueeze(0), size=(self.image_size, self.image_size), mode=interpolation_mode).squeeze(0)
+            if other_svbrdf is not None:
+                other_svbrdf = torch.nn.functional.interpolate(other_svbrdf.unsqueeze(0), size=(self.image_size, self.image_size), mode=interpolation_mode).squeeze(0)
         elif self.scale_mode == 'crop':
             width  = input_images.shape[-1]
             height = input_images.shape[-2]
@@ -77,89 +104,144 @@ class SvbrdfDataset(torch.utils.data.Dataset):
             # Determine the top left point of the cropped image
             # TODO: For random jittering, the crop size would need to be a little bit larger than the final size 
             #       and a final cropping stage would be needed after image generation, which produces slightly unaligned images.
-            crop_anchor = torch.IntTensor([0, 0])
+            crop_anchor = (0, 0)
             if self.random_crop:
-                crop_anchor = torch.IntTensor([np.random.randint(0, height - self.image_size + 1), np.random.randint(0, width - self.image_size + 1)])
+                crop_anchor = (np.random.randint(0, height - self.image_size + 1), np.random.randint(0, width - self.image_size + 1))
 
             # Crop down the svbrdf and the given input images
             svbrdf       = utils.crop_square(svbrdf, crop_anchor, self.image_size)
             input_images = utils.crop_square(input_images, crop_anchor, self.image_size) 
+            if other_svbrdf is not None:
+                other_svbrdf = utils.crop_square(other_svbrdf, crop_anchor, self.image_size)
         else:
             raise ValueError("Unknown scale mode {}".format(self.scale_mode))
 
-        # Transform to linear RGB
-        if not self.is_linear:
-            input_images = utils.gamma_decode(input_images)
+        if not self.defer_processing:
+            input_images = self.decode_input_images(input_images)
 
         # Images which cannot be read must be generated artificially
         generated_input_image_count = self.used_input_image_count - input_images.shape[0]
+        scene_parameters            = None
         if generated_input_image_count > 0:
-            renderings = self.render_inputs(svbrdf, generated_input_image_count)
-            input_images = torch.cat([input_images, renderings], dim=0)
+            scene_parameters = self.generate_scene_parameters(generated_input_image_count)
+            if not self.defer_processing:
+                # Render directly into the tail of the (preallocated) full set of input images
+                read_input_images = input_images
+                input_images      = torch.empty((self.used_input_image_count,) + read_input_images.shape[1:])
+                input_images[:read_input_images.shape[0]] = read_input_images
+                self.render_inputs(svbrdf, scene_parameters, out=input_images[read_input_images.shape[0]:])
 
         # TODO: For random jittering we would need to re-crop to the final size at this point 
         #       with individual crop anchors for all the images.
 
-        return {'inputs': input_images, 'svbrdf': svbrdf}
+        sample = {'inputs': input_images, 'svbrdf': svbrdf}
+        if other_svbrdf is not None:
+            sample['mix_svbrdf'] = other_svbrdf
+        if self.defer_processing and scene_parameters is not None:
+            sample['scene'] = scene_parameters
+
+        return sample
+
+    def decode_input_images(self, input_images):
+        input_images = utils.convert_to_float(input_images)
+
+        # Transform to linear RGB
+        if not self.is_linear:
+            input_images = utils.gamma_decode(input_images)
+
+        return input_images
 
-    def read_sample(self, file_path):
-        # Read full image
-        # TODO: Use utils.read_image_tensor()
-        full_image   = torch.Tensor(plt.imread(file_path)).permute(2, 0, 1)
+    def postprocess_batch(self, batch, device):
+        # With deferred processing, the input images are transferred in their raw form and decoded on the device.
+        # The copies are asynchronous if the batch resides in pinned memory.
+        inputs = batch['inputs'].to(device, non_blocking=True)
+        svbrdf = batch['svbrdf'].to(device, non_blocking=True)
+        if self.defer_processing:
+            inputs = self.decode_input_images(inputs)
+
+        # Mix the materials of all samples at once (with individual weights)
+        if 'mix_svbrdf' in batch:
+            other_svbrdf = batch['mix_svbrdf'].to(device, non_blocking=True)
+            alpha        = torch.empty((svbrdf.shape[0], 1, 1, 1), device=device).uniform_(0.1, 0.9)
+            svbrdf       = self.mix(svbrdf, other_svbrdf, alpha)
+
+        # Render the deferred input images for all samples of the batch at once
+        if 'scene' in batch:
+            scene_parameters = {name: parameter.to(device, non_blocking=True) for name, parameter in batch['scene'].items()}
+            renderings       = render_scenes(get_renderer(), svbrdf.unsqueeze(1), scene_parameters) # [b, n, 3, h, w]
+            inputs           = torch.cat([inputs, renderings], dim=1)
+
+        return inputs, svbrdf
+
+    def read_full_image(self, idx):
+        if self.memmap_path is None:
+            return utils.read_image_tensor(self.file_paths[idx], normalize=False)
+
+        if self.memmap is None:
+            # Map copy-on-write, so the tensors can share the memory without being read-only
+            self.memmap = np.load(self.memmap_path, mmap_mode='c')
+            if self.memmap.shape[0] != len(self.file_paths):
+                raise RuntimeError("Memory-mapped file '{}' contains {:d} samples but the data directory contains {:d}.".format(self.memmap_path, self.memmap.shape[0], len(self.file_paths)))
+
+        return torch.from_numpy(self.memmap[idx])
+
+    def read_sample(self, idx):
+        # Read full image (as uint8, the SVBRDF maps are only converted to float after splitting and the input images on demand)
+        full_image   = self.read_full_image(idx)
 
         # Split the full image apart along the horizontal direction 
         # Magick number 4 is the number of maps in the SVBRDF
         svbrdf_map_count = 0 if self.no_svbrdf else 4 
-        image_parts      = torch.cat(full_image.unsqueeze(0).chunk(self.input_image_count + svbrdf_map_count, dim=-1), 0) # [n, 3, 256, 256]
+        part_count       = self.input_image_count + svbrdf_map_count
+        part_height      = full_image.shape[-2]
+        part_width       = full_image.shape[-1] // part_count
+        image_parts      = full_image.view(3, part_height, part_count, part_width).permute(2, 0, 1, 3) # [n, 3, 256, 256]
 
         # Read the SVBRDF (dummy if there is none in the dataset)
+        # The maps are stored in the same order as in a packed SVBRDF, so it is built directly without unpacking and packing.
         svbrdf = None
         if self.no_svbrdf:
             # If there are no SVBRDFs in the data, there must be images which we can use as size guide.
             width  = image_parts[0].shape[-1]
             height = image_parts[0].shape[-2]
 
-            normals   = torch.cat([torch.zeros((2, height, width)), torch.ones((1, height, width))], dim=0)
-            diffuse   = torch.zeros_like(normals)
-            roughness = torch.zeros_like(normals)
-            specular  = torch.zeros_like(normals)
+            # All maps are zero, except for the z component of the normals
+            svbrdf    = torch.zeros((12, height, width))
+            svbrdf[2] = 1.0
         else:
-            normals   = image_parts[self.input_image_count + 0].unsqueeze(0)
-            normals   = utils.decode_from_unit_interval(normals)
-            diffuse   = image_parts[self.input_image_count + 1].unsqueeze(0)
-            roughness = image_parts[self.input_image_count + 2].unsqueeze(0)
-            specular  = image_parts[self.input_image_count + 3].unsqueeze(0)
+            # Materialize the maps and convert them to float in one go
+            svbrdf = utils.convert_to_float(image_parts[self.input_image_count:]).view(12, part_height, part_width) # [12, 256, 256]
 
-        svbrdf = utils.pack_svbrdf(normals, diffuse, roughness, specular).squeeze(0) # [12, 256, 256]
+            # Transform the normals from [0, 1] to [-1, 1]
+            svbrdf[0:3].mul_(2.0).sub_(1.0)
 
         # We read as many input images from the disk as we can
         # FIXME: This is a little bit counter-intuitive, as we are reading the last n images, not the first n
         read_input_image_count = min(self.input_image_count, self.used_input_image_count)
-        input_images           = image_parts[(self.input_image_count - read_input_image_count) : self.input_image_count] # [ni, 3, 256, 256]
+        input_images           = image_parts[(self.input_image_count - read_input_image_count) : self.input_image_count] # [ni, 3, 256, 256] (uint8)
 
         return input_images, svbrdf
 
     def mix(self, svbrdf_0, svbrdf_1, alpha=None):
+        # Handles single SVBRDFs as well as batches (where alpha is of shape [b, 1, 1, 1])
         if alpha is None:
             alpha = torch.Tensor(1).uniform_(0.1, 0.9)
 
-        normals_0, diffuse_0, roughness_0, specular_0 = utils.unpack_svbrdf(svbrdf_0)
-        normals_1, diffuse_1, roughness_1, specular_1 = utils.unpack_svbrdf(svbrdf_1)
+        # Mix all the maps at once and replace the normals afterwards
+        svbrdf_mixed = alpha * svbrdf_0 + (1.0 - alpha) * svbrdf_1
 
         # Reference "Project the normals to use the X and Y derivative"
-        normals_0_projected = normals_0 / torch.max(torch.Tensor([0.01]), normals_0[2:3,:,:])
-        normals_1_projected = normals_1 / torch.max(torch.Tensor([0.01]), normals_1[2:3,:,:])
+        normals_0           = svbrdf_0[...,0:3,:,:]
+        normals_1           = svbrdf_1[...,0:3,:,:]
+        normals_0_projected = normals_0 / normals_0[...,2:3,:,:].clamp(min=0.01)
+        normals_1_projected = normals_1 / normals_1[...,2:3,:,:].clamp(min=0.01)
 
         normals_mixed = alpha * normals_0_projected + (1.0 - alpha) * normals_1_projected
-        normals_mixed = normals_mixed / torch.sqrt(torch.sum(normals_mixed**2, axis=0,keepdim=True)) # Normalization
+        svbrdf_mixed[...,0:3,:,:] = torch.nn.functional.normalize(normals_mixed, dim=-3, eps=1e-12)
 
-        diffuse_mixed   = alpha * diffuse_0 + (1.0 - alpha) * diffuse_1
-        roughness_mixed = alpha * roughness_0 + (1.0 - alpha) * roughness_1
-        specular_mixed  = alpha * specular_0 + (1.0 - alpha) * specular_1
-        
-        return utils.pack_svbrdf(normals_mixed, diffuse_mixed, roughness_mixed, specular_mixed)
+        return svbrdf_mixed
 
-    def render_inputs(self, svbrdf, count):
+    def generate_scene_parameters(self, count):
         # Constants as defined in the reference code
         min_eps              = 0.001 # Reference: "allows near 90     degrees angles"
         max_eps              = 0.02  # Reference: "removes all angles below 8.13 degrees."
@@ -169,24 +251,24 @@ class SvbrdfDataset(torch.utils.data.Dataset):
         # Generate scenes (camera and light configurations)
         # The in the first configuration, the light and view direction are guaranteed to be perpendicular to the material sample.
         # For the remaining cases, both are randomly sampled from a hemisphere.
-        light_poses = torch.cat([torch.Tensor(2).uniform_(-0.75, 0.75), torch.ones(1) * fixed_light_distance], dim=-1).unsqueeze(0)
-        if count > 1:
-            light_poses_hemisphere = utils.generate_normalized_random_direction(count - 1, min_eps=min_eps, max_eps=max_eps) * fixed_light_distance
-            light_poses            = torch.cat([light_poses, light_poses_hemisphere], dim=0)
-
-        light_colors = torch.Tensor([30.0]).unsqueeze(-1)
+        # All parameters are sampled as numpy arrays and only converted to tensors at the very end.
+        rng                = get_rng()
+        light_poses        = np.empty((count, 3))
+        light_poses[0, :2] = rng.uniform(-0.75, 0.75, size=2)
+        light_poses[0, 2]  = fixed_light_distance
+        light_poses[1:]    = utils.generate_normalized_random_direction_numpy(count - 1, min_eps=min_eps, max_eps=max_eps, rng=rng) * fixed_light_distance
+
+        light_colors = np.full((count, 3), 30.0)
         if self.use_augmentation:
             # Reference: "add a normal distribution to the stddev so that sometimes in a minibatch all the images are consistant and sometimes crazy".
             # NOTE: For us, this effect will not be batch-wide but only for this individual sample.
             # FIXME: Since our renderer is differently implemented, the color variations with the given standard deviations
             #        merely have an effect.
-            std_deviation = torch.exp(torch.Tensor(1).normal_(mean = -2.0, std = 0.5)).numpy()[0]
-            light_colors  = torch.abs(torch.Tensor(count).normal_(mean = 20.0, std = std_deviation)).unsqueeze(-1)
-        light_colors = light_colors.expand(count, 3)
+            std_deviation = np.exp(rng.normal(-2.0, 0.5))
+            light_colors  = np.abs(rng.normal(20.0, std_deviation, size=(count, 1)))
 
-        # Handle white balance by varying the light color not the camera properties
-        if self.use_augmentation:
-            white_balance = torch.abs(torch.Tensor(count, 3).normal_(mean = 1.0, std = 0.03))
+            # Handle white balance by varying the light color not the camera properties
+            white_balance = np.abs(rng.normal(1.0, 0.03, size=(count, 3)))
             light_colors  = light_colors * white_balance
 
         if self.use_augmentation:
@@ -194,28 +276,112 @@ class SvbrdfDataset(torch.utils.data.Dataset):
             # NOTE: This probably does not do what the reference code expects it to do.
             #       The uniform distribution generates view distances in [0.25, 2.75] which
             #       correspond to FOVs between roughly 150 degrees and 40 degrees.
-            view_distance = torch.Tensor(count).uniform_(0.25, 2.75) 
+            view_distance = rng.uniform(0.25, 2.75, size=count)
         else:
-            view_distance = torch.ones(count) * fixed_view_distance
+            view_distance = np.full(count, fixed_view_distance)
 
-        view_poses = torch.cat([torch.Tensor(2).uniform_(-0.25, 0.25), view_distance[:1]], dim=-1).unsqueeze(0)
-        if count > 1:
-            view_poses_hemisphere = utils.generate_normalized_random_direction(count - 1, min_eps=min_eps, max_eps=max_eps) * view_distance[1:].unsqueeze(-1)
-            view_poses            = torch.cat([view_poses, view_poses_hemisphere], dim=0)
+        view_poses        = np.empty((count, 3))
+        view_poses[0, :2] = rng.uniform(-0.25, 0.25, size=2)
+        view_poses[0, 2]  = view_distance[0]
+        view_poses[1:]    = utils.generate_normalized_random_direction_numpy(count - 1, min_eps=min_eps, max_eps=max_eps, rng=rng) * view_distance[1:, np.newaxis]
 
-        renderer = renderers.LocalRenderer()
-        renderings = []
-        for i in range(count):
-            # TODO: Add spotlight support to the renderer (currentConeTargetPos in the reference code)
-            scene = env.Scene(env.Camera(view_poses[i]), env.Light(light_poses[i], light_colors[i]))
-            
-            rendering = renderer.render(scene, svbrdf.unsqueeze(0))
+        # Standard deviation of the simulated noise for each rendering
+        noise_std = np.exp(rng.normal(np.log(0.005), 0.3, size=count))
 
-            # Simulate noise
-            std_deviation_noise = torch.exp(torch.Tensor(1).normal_(mean = np.log(0.005), std=0.3)).numpy()[0]
-            noise               = torch.zeros_like(rendering).normal_(mean=0.0, std=std_deviation_noise)
-            rendering           = torch.clamp(rendering + noise, min=0.0, max=1.0)
+        scene_parameters = {'view_poses': view_poses, 'light_poses': light_poses, 'light_colors': light_colors, 'noise_std': noise_std}
+        return {name: torch.from_numpy(parameter.astype(np.float32)) for name, parameter in scene_parameters.items()}
 
-            renderings.append(rendering)
+    def render_inputs(self, svbrdf, scene_parameters, out=None):
+        view_poses   = scene_parameters['view_poses']
+        light_poses  = scene_parameters['light_poses']
+        light_colors = scene_parameters['light_colors']
+        noise_std    = scene_parameters['noise_std']
 
-        return torch.cat(renderings, dim=0)
\ No newline at end of file
+        count = view_poses.shape[0]
+        if out is None:
+            out = torch.empty(count, 3, svbrdf.shape[-2], svbrdf.shape[-1])
+
+        if renderers.numba is not None and svbrdf.device.type == 'cpu':
+            # Render all scenes at once with the compiled CPU kernel
+            renderers.render_local_numba(svbrdf, view_poses, light_poses, light_colors, out=out)
+        else:
+            # Render all scenes at once: the scene holds the [n, 3] parameters of all views and the svbrdf is broadcast against them
+            # TODO: Add spotlight support to the renderer (currentConeTargetPos in the reference code)
+            scene = env.Scene(env.Camera(view_poses), env.Light(light_poses, light_colors))
+            out.copy_(get_renderer().render(scene, svbrdf.unsqueeze(0)))
+
+        # Simulate noise (for all renderings at once)
+        noise = torch.empty_like(out).normal_().mul_(noise_std.view(-1, 1, 1, 1))
+        return out.add_(noise).clamp_(min=0.0, max=1.0)
+
+# Random engine for sampling the scenes of the generated input images and the materials to mix.
+# It is created lazily from the initial seed of torch, so it follows utils.enable_deterministic_random_engine() in the main process
+# and gets an individual seed in every data loader worker (torch seeds them with base seed + worker id).
+_rng      = None
+_rng_seed = None
+
+def get_rng():
+    global _rng, _rng_seed
+    seed = torch.initial_seed()
+    if _rng is None or _rng_seed != seed:
+        _rng      = np.random.default_rng(seed)
+        _rng_seed = seed
+    return _rng
+
+# Renderer shared by all renderings of a process.
+# It is created lazily and owned by the process that created it, so worker processes never inherit any (device) state from their parent.
+_renderer     = None
+_renderer_pid = None
+
+def get_renderer():
+    global _renderer, _renderer_pid
+    if _renderer is None or _renderer_pid != os.getpid():
+        _renderer     = renderers.LocalRenderer()
+        _renderer_pid = os.getpid()
+    return _renderer
+
+def render_scenes(renderer, svbrdf, scene_parameters):
+    # All scene parameters are of shape [..., n, 3] (noise: [..., n]) and the leading dimensions of the svbrdf must broadcast against them
+    scene     = env.Scene(env.Camera(scene_parameters['view_poses']), env.Light(scene_parameters['light_poses'], scene_parameters['light_colors']))
+    rendering = renderer.render(scene, svbrdf)
+
+    # Simulate noise
+    noise     = torch.randn_like(rendering) * scene_parameters['noise_std'].unsqueeze(-1).unsqueeze(-1).unsqueeze(-1)
+    return torch.clamp(rendering + noise, min=0.0, max=1.0)
+
+def seed_worker(worker_id):
+    # Torch seeds every data loader worker individually (base seed + worker id) but leaves
+    # the other random engines alone, so forked workers would otherwise share their state.
+    # (The random engine of get_rng() follows the seed of torch by itself.)
+    seed = torch.initial_seed() % 2**32
+    random.seed(seed)
+    np.random.seed(seed)
+
+def build_memmap(data_directory, output_path):
+    # Decode all samples of a dataset directory once and store them in a single uint8 array file (shape = [n, 3, h, w]).
+    # The order of the samples matches the order of SvbrdfDataset.file_paths.
+    file_paths = utils.list_files(data_directory)
+    if len(file_paths) == 0:
+        raise ValueError("Directory '{}' does not contain any samples.".format(data_directory))
+
+    first_image = utils.read_image_tensor(file_paths[0], normalize=False)
+    memmap      = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.uint8, shape=(len(file_paths),) + tuple(first_image.shape))
+    for i, file_path in enumerate(file_paths):
+        image = first_image if i == 0 else utils.read_image_tensor(file_path, normalize=False)
+        if image.shape != first_image.shape:
+            raise ValueError("Sample '{}' has shape {} but the samples are expected to be of shape {}.".format(file_path, tuple(image.shape), tuple(first_image.shape)))
+        memmap[i] = image.numpy()
+    memmap.flush()
+
+    return memmap.shape
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pre-decode the samples of a dataset directory into a memory-mapped file.')
+    parser.add_argument('input_dir',   help='Directory containing the input data.')
+    parser.add_argument('output_path', help='Path of the memory-mapped file (.npy) to create.')
+    args = parser.parse_args()
+
+    shape = build_memmap(args.input_dir, args.output_path)
+    print("Wrote {:d} samples of shape {} to '{}'".format(shape[0], shape[1:], args.output_path))
@@ -1,35 +1,42 @@
 import torch
 import utils
 
+# The positions and colors are either single vectors or batches of shape [..., 3] (one scene per vector).
+# If a device is given, they are stored as tensors on that device so rendering does not need to copy them there.
+
+def as_tensor(value, device):
+    return torch.as_tensor(value, dtype=torch.float32, device=device) if device is not None else value
+
 class Camera:
-    def __init__(self, pos):
-        self.pos = pos
+    def __init__(self, pos, device=None):
+        self.pos = as_tensor(pos, device)
 
 class Light:
-    def __init__(self, pos, color):
-        self.pos   = pos
-        self.color = color
+    def __init__(self, pos, color, device=None):
+        self.pos   = as_tensor(pos,   device)
+        self.color = as_tensor(color, device)
 
 class Scene:
+    # The light can also be a list of lights that illuminate the scene together
     def __init__(self, camera, light):
         self.camera = camera
         self.light  = light
 
-def generate_random_scenes(count):
+def generate_random_scenes(count, device=None):
     # Randomly distribute both, view and light positions
-    view_positions  = utils.generate_normalized_random_direction(count, 0.001, 0.1) # shape = [count, 3]
-    light_positions = utils.generate_normalized_random_direction(count, 0.001, 0.1)
+    view_positions  = utils.generate_normalized_random_direction(count, 0.001, 0.1).to(device) # shape = [count, 3]
+    light_positions = utils.generate_normalized_random_direction(count, 0.001, 0.1).to(device)
 
     scenes = []
     for i in range(count):
-        c = Camera(view_positions[i])
+        c = Camera(view_positions[i], device)
         # Light has lower power as the distance to the material plane is not as large
-        l = Light(light_positions[i], [20.0, 20.0, 20.0]) 
+        l = Light(light_positions[i], [20.0, 20.0, 20.0], device) 
         scenes.append(Scene(c, l))
 
     return scenes
 
-def generate_specular_scenes(count):
+def generate_specular_scenes(count, device=None):
     # Only randomly distribute view positions and place lights in a perfect mirror configuration
     view_positions  = utils.generate_normalized_random_direction(count, 0.001, 0.1) # shape = [count, 3]
     light_positions = view_positions * torch.Tensor([-1.0, -1.0, 1.0]).unsqueeze(0)
@@ -43,13 +50,13 @@ def generate_specular_scenes(count):
     #       This is because the camera is -looking- at the center of the patch.
     shift = torch.cat([torch.Tensor(count, 2).uniform_(-1.0, 1.0), torch.zeros((count, 1)) + 0.0001], dim=-1)
 
-    view_positions  = view_positions  * distance_view  + shift
-    light_positions = light_positions * distance_light + shift
+    view_positions  = (view_positions  * distance_view  + shift).to(device)
+    light_positions = (light_positions * distance_light + shift).to(device)
 
     scenes = []
     for i in range(count):
-        c = Camera(view_positions[i])
-        l = Light(light_positions[i], [50.0, 50.0, 50.0])
+        c = Camera(view_positions[i], device)
+        l = Light(light_positions[i], [50.0, 50.0, 50.0], device)
         scenes.append(Scene(c, l))
 
     return scenes
@@ -67,6 +74,7 @@ if __name__ == '__main__':
 
     # Generate some random scenes
 
+    @torch.inference_mode()
     def render_scenes(scenes, tag):
         for i, scene in enumerate(scenes):
             # Get one sample
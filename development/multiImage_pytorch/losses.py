@@ -32,7 +32,7 @@ class RenderingLoss(nn.Module):
         batch_input_renderings = []
         batch_target_renderings = []
         for i in range(batch_size):
-            scenes = env.generate_random_scenes(self.random_configuration_count) + env.generate_specular_scenes(self.specular_configuration_count)
+            scenes = env.generate_random_scenes(self.random_configuration_count, input.device) + env.generate_specular_scenes(self.specular_configuration_count, input.device)
             input_svbrdf  = input[i]
             target_svbrdf = target[i]
             input_renderings  = []
@@ -1,108 +1,288 @@
 import cv2
+import functools
 import math
 import numpy as np
 import pyredner
 import utils
 import torch
 
+# Numba is optional and only used for rendering on the CPU (see render_local_numba())
+try:
+    import numba
+except ImportError:
+    numba = None
+
 def dot_product(a, b):
-    return torch.sum(torch.mul(a, b), dim=-3, keepdim=True)
+    # Fused reduction over the channel dimension (no intermediate elementwise product).
+    # The channel dimension is removed (shape = [..., h, w]), so add it back where the result meets multi-channel tensors.
+    # Unlike an elementwise product, vecdot does not promote mixed types (e.g. half precision normals and single precision directions).
+    dtype = torch.result_type(a, b)
+    return torch.linalg.vecdot(a.to(dtype), b.to(dtype), dim=-3)
+
+def channels_last(a):
+    # Stores the channel dimension (-3) innermost in memory without changing the logical shape, so the reductions
+    # over the channels are stride-1 (for 4D tensors, this is the same as torch.channels_last but it works for any rank)
+    return a.movedim(-3, -1).contiguous().movedim(-1, -3)
 
 def normalize(a):
-    return torch.div(a, torch.sqrt(dot_product(a, a)))
+    # Fused normalization over the channel dimension (the epsilon guards against zero-length vectors)
+    return torch.nn.functional.normalize(a, dim=-3, eps=1e-12)
+
+@functools.lru_cache(maxsize=8)
+def surface_coordinates(height, width, device, dtype):
+    # Generate surface coordinates for the material patch (shape = [3, h, w], cached per resolution, device and type)
+    # The center point of the patch is located at (0, 0, 0) which is the center of the global coordinate system.
+    # The patch itself spans from (-1, -1, 0) to (1, 1, 0).
+    # The cached tensor must be a normal tensor even if it is first created in inference mode, as it is also used for training
+    with torch.inference_mode(False):
+        ycoords, xcoords = torch.meshgrid(torch.linspace(1, -1, height, device=device, dtype=dtype), torch.linspace(-1, 1, width, device=device, dtype=dtype), indexing='ij')
+
+        # Fill the coordinates directly in channels last layout (the z coordinate is zero)
+        coords = torch.zeros((height, width, 3), device=device, dtype=dtype)
+        coords[..., 0] = xcoords
+        coords[..., 1] = ycoords
+        return coords.movedim(-1, -3)
+
+# The BRDF of the local renderer. The functions are compiled as a whole with TorchScript (by scripting evaluate_brdf()),
+# so the long chain of pointwise operations can be fused into a few kernels.
+# NOTE: The characteristic function (x > 0) of the reference model is omitted in the distribution and geometry terms,
+#       because all dot products passed to them are clamped to positive values (i. e., it is always one).
+
+def compute_diffuse_term(diffuse, ks):
+    kd = (1.0 - ks)
+    return  kd * diffuse / math.pi
+
+def compute_microfacet_distribution(alpha_squared, NH):
+    NH_squared       = NH**2
+    denominator_part = torch.clamp(NH_squared * (alpha_squared + (1 - NH_squared) / NH_squared), min=0.001)
+    return alpha_squared / (math.pi * denominator_part**2)
+
+def compute_fresnel(specular, VH):
+    # The reference work uses an approximation from:
+    # https://cdn2.unrealengine.com/Resources/files/2013SiggraphPresentationsNotes-26915738.pdf
+    # The fifth power is expanded into multiplications (a generic power goes through exp and log)
+    one_minus_VH         = 1.0 - VH
+    one_minus_VH_squared = one_minus_VH * one_minus_VH
+    return specular + (1.0 - specular) * (one_minus_VH_squared * one_minus_VH_squared * one_minus_VH)
+
+def compute_geometry(alpha_squared, VN, LN):
+    # Smith shadowing-masking as the product of the G1 terms of the view and light directions.
+    # G1 = 2 / (1 + sqrt(1 + alpha^2 * (1 - XN^2) / XN^2)) is expanded by XN to save the inner division.
+    VN_squared = VN * VN
+    LN_squared = LN * LN
+    g1_view    = 2 * VN / (VN + torch.sqrt(VN_squared + alpha_squared * (1.0 - VN_squared)))
+    g1_light   = 2 * LN / (LN + torch.sqrt(LN_squared + alpha_squared * (1.0 - LN_squared)))
+    return g1_view * g1_light
+
+def compute_specular_term(wi, wo, normals, diffuse, alpha_squared, specular, light_cosine):
+    # Compute the half direction
+    H = normalize((wi + wo) / 2.0)
+
+    # Precompute some dot product (the cosine between light and normal is shared with the irradiance computation)
+    NH  = torch.clamp(dot_product(normals, H),  min=0.001)
+    VH  = torch.clamp(dot_product(wo, H),       min=0.001)
+    VN  = torch.clamp(dot_product(wo, normals), min=0.001)
+    LN  = torch.clamp(light_cosine,             min=0.001)
+
+    # The dot products only get a channel dimension where they are combined with the maps.
+    # The microfacet distribution is very sensitive to NH for low roughness, so it is always computed in the precision of the geometry,
+    # while the fresnel and geometry terms use the (possibly reduced) precision of the maps.
+    brdf_dtype = specular.dtype
+    F = compute_fresnel(specular, VH.unsqueeze(-3).to(brdf_dtype))
+    G = compute_geometry(alpha_squared.to(brdf_dtype), VN.unsqueeze(-3).to(brdf_dtype), LN.unsqueeze(-3).to(brdf_dtype))
+    D = compute_microfacet_distribution(alpha_squared, NH.unsqueeze(-3))
+
+    # We treat the fresnel term as the portion of light that is reflected
+    # FIXME: That means we cannot model perfectly diffuse surfaces (at steep angle we always have reflections) but does that matter?
+    return F * G * D / (4.0 * VN * LN).unsqueeze(-3), F
+
+@torch.jit.script
+def evaluate_brdf(wi, wo, normals, diffuse, roughness, specular, light_cosine):
+    # The light cosine is the (unclamped) dot product of wi and the normals (shape = [..., h, w]).
+
+    # Squared GGX alpha (alpha = roughness^2) shared by the distribution and geometry terms.
+    # Avoid zero roughness (i. e., potential division by zero), equivalent to a minimum roughness of 0.001.
+    alpha         = torch.clamp(roughness * roughness, min=1e-6)
+    alpha_squared = alpha * alpha
+
+    specular_term, ks = compute_specular_term(wi, wo, normals, diffuse, alpha_squared, specular, light_cosine)
+    diffuse_term      = compute_diffuse_term(diffuse, ks)
+    return diffuse_term + specular_term
 
 class LocalRenderer:
-    def xi(self, x):
-        return (x > 0.0) * torch.ones_like(x)
-
-    def compute_diffuse_term(self, diffuse, ks):
-        kd = (1.0 - ks)
-        return  kd * diffuse / math.pi
-
-    def compute_microfacet_distribution(self, roughness, NH):
-        alpha            = roughness**2
-        alpha_squared    = alpha**2 
-        NH_squared       = NH**2
-        denominator_part = torch.clamp(NH_squared * (alpha_squared + (1 - NH_squared) / NH_squared), min=0.001)
-        return (alpha_squared * self.xi(NH)) / (math.pi * denominator_part**2)
-
-    def compute_fresnel(self, specular, VH):
-        # The reference work uses an approximation from:
-        # https://cdn2.unrealengine.com/Resources/files/2013SiggraphPresentationsNotes-26915738.pdf
-        return specular + (1.0 - specular) * (1.0 - VH)**5
-
-    def compute_g1(self, roughness, XH, XN):
-        alpha         = roughness**2
-        alpha_squared = alpha**2
-        XN_squared    = XN**2
-        return 2 * self.xi(XH / XN) / (1 + torch.sqrt(1 + alpha_squared * (1.0 - XN_squared) / XN_squared))
-
-    def compute_geometry(self, roughness, VH, LH, VN, LN):
-        return self.compute_g1(roughness, VH, VN) * self.compute_g1(roughness, LH, LN)
-
-    def compute_specular_term(self, wi, wo, normals, diffuse, roughness, specular):
-        # Compute the half direction
-        H = normalize((wi + wo) / 2.0)
-
-        # Precompute some dot product
-        NH  = torch.clamp(dot_product(normals, H),  min=0.001)
-        VH  = torch.clamp(dot_product(wo, H),       min=0.001)
-        LH  = torch.clamp(dot_product(wi, H),       min=0.001)
-        VN  = torch.clamp(dot_product(wo, normals), min=0.001)
-        LN  = torch.clamp(dot_product(wi, normals), min=0.001)
-
-        F = self.compute_fresnel(specular, VH)
-        G = self.compute_geometry(roughness, VH, LH, VN, LN)
-        D = self.compute_microfacet_distribution(roughness, NH)
-        
-        # We treat the fresnel term as the portion of light that is reflected
-        # FIXME: That means we cannot model perfectly diffuse surfaces (at steep angle we always have reflections) but does that matter?
-        return F * G * D / (4.0 * VN * LN), F
-
-    def evaluate_brdf(self, wi, wo, normals, diffuse, roughness, specular):
-        specular_term, ks = self.compute_specular_term(wi, wo, normals, diffuse, roughness, specular)
-        diffuse_term      = self.compute_diffuse_term(diffuse, ks)
-        return diffuse_term + specular_term
+    def __init__(self, dtype=None, compile=False):
+        # Optional reduced precision (e.g. torch.bfloat16) for the maps and the fresnel and geometry terms of the BRDF.
+        # The geometry (coordinates, directions, dot products and falloff) and the microfacet distribution are always computed in
+        # (at least) single precision, because neighboring surface coordinates are not distinguishable in half precision and
+        # the distribution of low roughness materials is too sensitive to errors in NH.
+        self.dtype = dtype
+
+        # Optionally compile the tensor part of the rendering with torch.compile (the first renderings of each shape take considerably longer).
+        # CUDA graphs (mode='reduce-overhead') are not used, because the rendering loss keeps the outputs of many renderings alive until
+        # the backward pass, while a graph replay would overwrite them.
+        if compile:
+            self.render_tensors = torch.compile(self.render_tensors, dynamic=False)
+
+    def evaluate_brdf(self, wi, wo, normals, diffuse, roughness, specular, light_cosine):
+        return evaluate_brdf(wi, wo, normals, diffuse, roughness, specular, light_cosine)
 
     def render(self, scene, svbrdf):
+        # The positions and colors in the scene can be batched with shape [..., 3], in which case
+        # the leading dimensions of the svbrdf (shape = [..., 12, h, w]) must broadcast against them.
+        # The light of the scene can also be a list of lights, which all illuminate the material at once.
         device = svbrdf.device
+        dtype  = torch.promote_types(svbrdf.dtype, torch.float32)
+
+        # The surface coordinates only depend on the resolution, so they are reused across renderings
+        coords = surface_coordinates(svbrdf.shape[-2], svbrdf.shape[-1], device, dtype)
 
-        # Generate surface coordinates for the material patch
-        # The center point of the patch is located at (0, 0, 0) which is the center of the global coordinate system.
-        # The patch itself spans from (-1, -1, 0) to (1, 1, 0).
-        xcoords_row  = torch.linspace(-1, 1, svbrdf.shape[-1], device=device)
-        xcoords      = xcoords_row.unsqueeze(0).expand(svbrdf.shape[-2], svbrdf.shape[-1]).unsqueeze(0)
-        ycoords      = -1 * torch.transpose(xcoords, dim0=1, dim1=2)
-        coords       = torch.cat((xcoords, ycoords, torch.zeros_like(xcoords)), dim=0)
+        # Multiple lights are evaluated at once in an additional leading dimension (shape = [l, ..., 3])
+        lights      = scene.light if isinstance(scene.light, (list, tuple)) else None
+        stack       = lambda values: torch.stack(torch.broadcast_tensors(*[torch.as_tensor(v, dtype=dtype, device=device) for v in values]))
+        light_pos   = stack([light.pos   for light in lights]) if lights is not None else scene.light.pos
+        light_color = stack([light.color for light in lights]) if lights is not None else scene.light.color
+
+        if lights is not None:
+            # The lights dimension must be in front of all batch dimensions (of the svbrdf, the camera and the lights themselves)
+            batch_dims  = max(svbrdf.dim() - 3, torch.as_tensor(scene.camera.pos).dim() - 1, light_pos.dim() - 2, light_color.dim() - 2)
+            pad         = lambda values: values.view(values.shape[0], *[1] * (batch_dims - (values.dim() - 2)), *values.shape[1:])
+            light_pos   = pad(light_pos)
+            light_color = pad(light_color)
 
         # [x,y,z] (shape = (3)) -> [[[x]], [[y]], [[z]]] (shape = (3, 1, 1))
-        camera_pos          = torch.Tensor(scene.camera.pos).unsqueeze(-1).unsqueeze(-1).to(device)
+        as_tensor   = lambda value: torch.as_tensor(value, dtype=dtype, device=device).unsqueeze(-1).unsqueeze(-1)
+        radiance    = self.render_tensors(svbrdf, coords, as_tensor(scene.camera.pos), as_tensor(light_pos), as_tensor(light_color), lights is not None)
+
+        # A single svbrdf and scene still produce a batch of one rendering
+        if len(radiance.shape) == 3:
+            radiance = radiance.unsqueeze(0)
+
+        return radiance
+
+    def render_tensors(self, svbrdf, coords, camera_pos, light_pos, light_color, sum_lights):
+        # Renders the svbrdf with the scene given as tensors of shape [..., 3, 1, 1] (see render())
+
         # We treat the center of the material patch as focal point of the camera
         relative_camera_pos = camera_pos - coords
         wo                  = normalize(relative_camera_pos)
 
-        normals, diffuse, roughness, specular = utils.unpack_svbrdf(svbrdf)
+        # Work on densely packed maps in channels last layout (the elementwise results inherit it)
+        normals, diffuse, roughness, specular = [channels_last(m) for m in utils.unpack_svbrdf(svbrdf)]
 
-        # Avoid zero roughness (i. e., potential division by zero)
-        roughness = torch.clamp(roughness, min=0.001)
+        # The normals and the roughness stay in the precision of the geometry, only the other maps are converted to the precision of the BRDF
+        brdf_dtype = self.dtype if self.dtype is not None else svbrdf.dtype
+        normals    = normals.to(coords.dtype)
 
-        # For each light do:
-        # [x,y,z] (shape = (3)) -> [[[x]], [[y]], [[z]]] (shape = (3, 1, 1))
-        light_pos          = torch.Tensor(scene.light.pos).unsqueeze(-1).unsqueeze(-1).to(device)
         relative_light_pos = light_pos - coords
         wi                 = normalize(relative_light_pos)
 
-        f  = self.evaluate_brdf(wi, wo, normals, diffuse, roughness, specular)
-        LN = torch.clamp(dot_product(wi, normals), min=0.0) # Only consider the upper hemisphere
+        light_cosine = dot_product(wi, normals)
+
+        f  = self.evaluate_brdf(wi, wo, normals, diffuse.to(brdf_dtype), roughness.to(coords.dtype), specular.to(brdf_dtype), light_cosine)
+        LN = torch.clamp(light_cosine, min=0.0) # Only consider the upper hemisphere
 
-        light_color = torch.Tensor(scene.light.color).unsqueeze(-1).unsqueeze(-1).unsqueeze(0).to(device)
-        falloff     = 1.0 / torch.sqrt(dot_product(relative_light_pos, relative_light_pos))**2 # Radial light intensity falloff
-        radiance    = torch.mul(torch.mul(f, light_color * falloff), LN)
+        falloff     = 1.0 / dot_product(relative_light_pos, relative_light_pos).clamp_min(1e-8) # Radial light intensity falloff (inverse squared distance)
+        irradiance  = (LN * falloff).unsqueeze(-3) # Single channel, so the colors are only applied once to the full BRDF values
+        radiance    = f * light_color * irradiance
+
+        # Accumulate the contributions of all lights
+        if sum_lights:
+            radiance = radiance.sum(dim=0)
 
         # TODO: Add camera exposure
 
         return radiance
 
+def _render_local_kernel(svbrdf, camera_positions, light_positions, light_colors, out):
+    # Scalar version of LocalRenderer.render() for a single svbrdf [12, h, w] and n scenes, writing into out [n, 3, h, w].
+    # The scenes are rendered in parallel.
+    height = svbrdf.shape[1]
+    width  = svbrdf.shape[2]
+    for k in numba.prange(camera_positions.shape[0]):
+        for i in range(height):
+            # Same surface coordinates as in LocalRenderer.render()
+            y = 1.0 - 2.0 * i / (height - 1)
+            for j in range(width):
+                x = -1.0 + 2.0 * j / (width - 1)
+
+                ox = camera_positions[k, 0] - x
+                oy = camera_positions[k, 1] - y
+                oz = camera_positions[k, 2]
+                o_norm = math.sqrt(ox * ox + oy * oy + oz * oz)
+                ox /= o_norm
+                oy /= o_norm
+                oz /= o_norm
+
+                lx = light_positions[k, 0] - x
+                ly = light_positions[k, 1] - y
+                lz = light_positions[k, 2]
+                light_distance_squared = lx * lx + ly * ly + lz * lz
+                l_norm = math.sqrt(light_distance_squared)
+                light_distance_squared = max(light_distance_squared, 1e-8)
+                lx /= l_norm
+                ly /= l_norm
+                lz /= l_norm
+
+                hx = (lx + ox) / 2.0
+                hy = (ly + oy) / 2.0
+                hz = (lz + oz) / 2.0
+                h_norm = math.sqrt(hx * hx + hy * hy + hz * hz)
+                hx /= h_norm
+                hy /= h_norm
+                hz /= h_norm
+
+                nx = svbrdf[0, i, j]
+                ny = svbrdf[1, i, j]
+                nz = svbrdf[2, i, j]
+
+                NH = max(nx * hx + ny * hy + nz * hz, 0.001)
+                VH = max(ox * hx + oy * hy + oz * hz, 0.001)
+                VN = max(ox * nx + oy * ny + oz * nz, 0.001)
+                LN = max(lx * nx + ly * ny + lz * nz, 0.001)
+
+                NH_squared = NH * NH
+                VN_squared = VN * VN
+                LN_squared = LN * LN
+                fresnel_factor = (1.0 - VH) ** 5
+
+                # Only consider the upper hemisphere and apply the radial light intensity falloff
+                irradiance_factor = max(lx * nx + ly * ny + lz * nz, 0.0) / light_distance_squared
+
+                for c in range(3):
+                    diffuse   = svbrdf[3 + c, i, j]
+                    roughness = svbrdf[6 + c, i, j]
+                    specular  = svbrdf[9 + c, i, j]
+
+                    # Same minimum alpha as in LocalRenderer (i. e., a minimum roughness of 0.001)
+                    alpha         = max(roughness * roughness, 1e-6)
+                    alpha_squared = alpha * alpha
+
+                    F = specular + (1.0 - specular) * fresnel_factor
+                    G = (2.0 / (1.0 + math.sqrt(1.0 + alpha_squared * (1.0 - VN_squared) / VN_squared))) * \
+                        (2.0 / (1.0 + math.sqrt(1.0 + alpha_squared * (1.0 - LN_squared) / LN_squared)))
+                    denominator_part = max(NH_squared * (alpha_squared + (1.0 - NH_squared) / NH_squared), 0.001)
+                    D = alpha_squared / (math.pi * denominator_part * denominator_part)
+
+                    f = (1.0 - F) * diffuse / math.pi + F * G * D / (4.0 * VN * LN)
+                    out[k, c, i, j] = f * light_colors[k, c] * irradiance_factor
+
+if numba is not None:
+    _render_local_kernel = numba.njit(parallel=True, fastmath=True, cache=True)(_render_local_kernel)
+
+def render_local_numba(svbrdf, camera_positions, light_positions, light_colors, out=None):
+    # Renders a single svbrdf (shape = [12, h, w]) with n scenes (positions and colors of shape [n, 3]) like LocalRenderer.render() 
+    # but with a compiled CPU kernel. The renderings (shape = [n, 3, h, w]) are written into out if given.
+    if numba is None:
+        raise RuntimeError("Rendering with numba requires the numba package.")
+
+    if out is None:
+        out = torch.empty((camera_positions.shape[0], 3) + tuple(svbrdf.shape[-2:]))
+
+    as_array = lambda tensor: np.ascontiguousarray(torch.as_tensor(tensor).detach().cpu().numpy(), dtype=np.float32)
+    _render_local_kernel(as_array(svbrdf), as_array(camera_positions), as_array(light_positions), as_array(light_colors), out.numpy())
+
+    return out
+
 class OrthoToPerspectiveMapping:
     def __init__(self, camera, sensor_size):
             self.sensor_size = sensor_size
@@ -111,7 +291,7 @@ class OrthoToPerspectiveMapping:
             # sample perspectively aswell (because why not). Therefore, we first build a projection matrix for the camera.
 
             # The camera's principal axis points from the camera center to the origin
-            C  = np.array(camera.pos)
+            C  = torch.as_tensor(camera.pos, dtype=torch.float64).cpu().numpy() # The position can also be a tensor on the GPU
             cz = -C / np.linalg.norm(C)    
 
             # The up direction is defined by the normal vector of the material sample plane (z axis)
@@ -239,7 +419,7 @@ class RednerRenderer:
             material_patch = pyredner.Object(vertices=self.patch_vertices, uvs=self.patch_uvs, indices=self.patch_indices, material=material)
 
             # Define the camera parameters (focused at the middle of the patch) and make sure we always have a valid 'up' direction
-            position = np.array(scene.camera.pos)
+            position = torch.as_tensor(scene.camera.pos, dtype=torch.float64).cpu().numpy() # The position can also be a tensor on the GPU
             lookat   = np.array([0.0, 0.0, 0.0])
             cz       = lookat - position          # Principal axis
             up       = np.array([0.0, 0.0, 1.0])
@@ -257,10 +437,10 @@ class RednerRenderer:
             #                                    intensity = torch.tensor(scene.light.color).to(self.redner_device))
             # img = pyredner.render_deferred(scene = full_scene, lights = [light])
 
-            light = pyredner.generate_quad_light(position  = torch.Tensor(scene.light.pos).to(self.redner_device),
+            light = pyredner.generate_quad_light(position  = torch.as_tensor(scene.light.pos, dtype=torch.float32).to(self.redner_device),
                                                  look_at   = torch.zeros(3).to(self.redner_device),
                                                  size      = torch.Tensor([0.6, 0.6]).to(self.redner_device),
-                                                 intensity = torch.Tensor(scene.light.color).to(self.redner_device))
+                                                 intensity = torch.as_tensor(scene.light.color, dtype=torch.float32).to(self.redner_device))
             full_scene = pyredner.Scene(camera = camera, objects = [material_patch, light])
             img = pyredner.render_pathtracing(full_scene, num_samples=(16,8))
 
@@ -274,6 +454,7 @@ if __name__ == '__main__':
     import dataset
     import environment as env
     import matplotlib.pyplot as plt
+    import torchvision
     import utils
 
     data   = dataset.SvbrdfDataset(data_directory="./data/train", image_size=256, input_image_count=10, used_input_image_count=1, use_augmentation=True, scale_mode='crop')
@@ -285,53 +466,34 @@ if __name__ == '__main__':
 
     perspective_mapping = OrthoToPerspectiveMapping(scene.camera, (600, 600))
 
-    fig = plt.figure(figsize=(8, 8))
-    row_count = 2 * len(data)
-    col_count = 5
-    for i_row, batch in enumerate(loader):
-        batch_inputs = batch["inputs"]
-        batch_svbrdf = batch["svbrdf"]
+    # Collect the tiles of all samples (one row per sample) and show them as a single grid image
+    tiles = []
+    # Only render for display, so no gradients are needed
+    with torch.inference_mode():
+        for batch in loader:
+            batch_inputs = batch["inputs"]
+            batch_svbrdf = batch["svbrdf"]
 
-        # We only have one image in the inputs
-        batch_inputs.squeeze_(0)
+            # We only have one image in the inputs
+            batch_inputs.squeeze_(0)
 
-        input       = utils.gamma_encode(batch_inputs)
-        svbrdf      = batch_svbrdf
+            input       = utils.gamma_encode(batch_inputs).squeeze(0)
+            svbrdf      = batch_svbrdf
 
-        normals, diffuse, roughness, specular = utils.unpack_svbrdf(svbrdf)
+            normals, diffuse, roughness, specular = utils.unpack_svbrdf(svbrdf.squeeze(0))
+            tiles.extend([input, utils.encode_as_unit_interval(normals), diffuse, roughness, specular])
 
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 1)
-        plt.imshow(input.squeeze(0).permute(1, 2, 0))
-        plt.axis('off')
+            rendering = utils.gamma_encode(renderer.render(scene, svbrdf)).squeeze(0)
+            tiles.append(rendering)
 
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 2)
-        plt.imshow(utils.encode_as_unit_interval(normals.squeeze(0).permute(1, 2, 0)))
-        plt.axis('off')
+            # The perspective rendering is scaled to the size of the other tiles
+            perspective_rendering = torch.from_numpy(perspective_mapping.apply(rendering.permute(1, 2, 0).numpy())).permute(2, 0, 1)
+            tiles.append(torch.nn.functional.interpolate(perspective_rendering.unsqueeze(0), size=rendering.shape[-2:], mode='area').squeeze(0))
 
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 3)
-        plt.imshow(diffuse.squeeze(0).permute(1, 2, 0))
-        plt.axis('off')
+            tiles.append(utils.gamma_encode(redner_renderer.render(scene, svbrdf)).squeeze(0))
 
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 4)
-        plt.imshow(roughness.squeeze(0).permute(1, 2, 0))
-        plt.axis('off')
-
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 5)
-        plt.imshow(specular.squeeze(0).permute(1, 2, 0))
-        plt.axis('off')
-        
-        rendering    = utils.gamma_encode(renderer.render(scene, utils.pack_svbrdf(normals, diffuse, roughness, specular))).squeeze(0).permute(1, 2, 0)
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 6)
-        plt.imshow(rendering)
-        plt.axis('off')
-
-        perspective_rendering = perspective_mapping.apply(rendering.numpy())
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 7)
-        plt.imshow(perspective_rendering)
-        plt.axis('off')
-
-        rendering    = utils.gamma_encode(redner_renderer.render(scene, utils.pack_svbrdf(normals, diffuse, roughness, specular))).squeeze(0).permute(1, 2, 0)
-        fig.add_subplot(row_count, col_count, 2 * i_row * col_count + 8)
-        plt.imshow(rendering)
-        plt.axis('off')
+    grid = torchvision.utils.make_grid([torch.clamp(tile, min=0.0, max=1.0) for tile in tiles], nrow=8)
+    plt.figure(figsize=(16, 2 * len(data)))
+    plt.imshow(grid.permute(1, 2, 0))
+    plt.axis('off')
     plt.show()
\ No newline at end of file
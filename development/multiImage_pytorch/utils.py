@@ -1,8 +1,10 @@
 import math
 import numpy as np
+import os
 from PIL import Image
 import random
 import torch
+import torchvision
 
 def enable_deterministic_random_engine(seed=313):
     random.seed(seed)
@@ -13,20 +15,77 @@ def enable_deterministic_random_engine(seed=313):
     torch.manual_seed(seed)
 
 def crop_square(tensor, anchor, size):
+    # The anchor is a (y, x) pair given as tuple or tensor, or a tensor with one pair for each image
     num_dimensions = len(tensor.shape)
-    if num_dimensions == 3:
-        return tensor[:, anchor[0] : anchor[0] + size, anchor[1] : anchor[1] + size]
-    elif num_dimensions == 4:
-        if len(anchor.shape) == 1: # Only one anchor for all images
-            return tensor[:, :, anchor[0] : anchor[0] + size, anchor[1] : anchor[1] + size]
-        elif len(anchor.shape) == 2: # One anchor for each image (handle cropping individually)
+    if num_dimensions == 3 or num_dimensions == 4:
+        if num_dimensions == 4 and torch.is_tensor(anchor) and len(anchor.shape) == 2: # One anchor for each image (handle cropping individually)
             images = torch.split(tensor, 1, dim=0)
-            for i in range(len(images)):
-                images[i] = crop_square(images[i], anchor[i], size)
-            return torch.cat(images, dim=0)
+            return torch.cat([crop_square(images[i], anchor[i], size) for i in range(len(images))], dim=0)
+
+        # Only one anchor for all images
+        y, x = int(anchor[0]), int(anchor[1])
+        return tensor[..., y : y + size, x : x + size]
     else:
         raise Exception("Cannot crop tensor of dimension {:d}".format(num_dimensions)) 
 
+def convert_to_float(images):
+    # Maps uint8 images to [0, 1] (floating point images are passed through)
+    if images.dtype != torch.uint8:
+        return images
+
+    return images.to(torch.float32, memory_format=torch.contiguous_format).div_(255.0)
+
+class CUDAPrefetcher:
+    """
+    Class that wraps a data loader and copies the next batch to the device on a side stream while the current batch is processed.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+        # Without CUDA, the batches are simply copied to the device when they are loaded
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        iterator   = iter(self.loader)
+        next_batch = self.preload(iterator)
+        while next_batch is not None:
+            batch = next_batch
+            if self.stream is not None:
+                # Wait for the copy and hand the memory of the batch over to the compute stream
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(self.stream)
+                map_tensors(batch, lambda tensor: tensor.record_stream(current_stream))
+
+            # Start copying the next batch before the current one is processed
+            next_batch = self.preload(iterator)
+            yield batch
+
+    def preload(self, iterator):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+
+        if self.stream is None:
+            return map_tensors(batch, lambda tensor: tensor.to(self.device))
+
+        with torch.cuda.stream(self.stream):
+            return map_tensors(batch, lambda tensor: tensor.to(self.device, non_blocking=True))
+
+def map_tensors(data, function):
+    # Applies the function to all tensors in a (nested) collection of dicts, lists and tuples
+    if torch.is_tensor(data):
+        return function(data)
+    elif isinstance(data, dict):
+        return {key: map_tensors(value, function) for key, value in data.items()}
+    elif isinstance(data, (list, tuple)):
+        return type(data)(map_tensors(value, function) for value in data)
+    return data
+
 def gamma_decode(images):
     return torch.pow(images, 2.2)
 
@@ -110,6 +169,27 @@ def generate_normalized_random_direction(count, min_eps = 0.001, max_eps = 0.05)
 
     return torch.cat([x, y, z], axis=-1)
 
+def generate_normalized_random_direction_numpy(count, min_eps = 0.001, max_eps = 0.05, rng = None):
+    # Without a dedicated generator, the global numpy random engine is used
+    rng = np.random if rng is None else rng
+
+    r1 = rng.uniform(0.0 + min_eps, 1.0 - max_eps, size=count)
+    r2 = rng.uniform(0.0, 1.0, size=count)
+
+    r   = np.sqrt(r1)
+    phi = 2 * math.pi * r2
+
+    x = r * np.cos(phi)
+    y = r * np.sin(phi)
+    z = np.sqrt(1.0 - r**2)
+
+    return np.stack([x, y, z], axis=-1)
+
+def list_files(directory):
+    # A single directory scan provides the file type of the entries without an extra stat per file
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries if entry.is_file())
+
 def read_image(path): 
     image = Image.open(path)
     mode  = image.mode
@@ -125,8 +205,15 @@ def read_image(path):
 
     return image
 
-def read_image_tensor(path):
-    return torch.Tensor(read_image(path)).permute(2, 0, 1)
+def read_image_tensor(path, normalize=True):
+    # Decode directly into a [c, h, w] uint8 tensor (an alpha channel is dropped)
+    image = torchvision.io.read_image(str(path), torchvision.io.ImageReadMode.RGB)
+
+    # Converting to float is deferred to the caller if requested, because it quadruples the size of the image
+    if normalize:
+        image = convert_to_float(image)
+
+    return image
 
 def write_image(path, image):
     Image.fromarray(np.uint8(np.clip(image, 0.0, 1.0) * 255.0)).save(path)
@@ -148,6 +235,7 @@ def write_image_tensor(path, tensor):
 
 if __name__ == '__main__':
     import math
+    import renderers
     import unittest
 
     class TestGammaFunctions(unittest.TestCase):
@@ -242,6 +330,111 @@ if __name__ == '__main__':
             # TODO: Implement
             self.assertEqual(1, 1)        
 
+    class TestLocalRenderer(unittest.TestCase):
+        def setUp(self):
+            import environment as env
+
+            self.renderer = renderers.LocalRenderer()
+            self.svbrdf   = torch.rand(2, 12, 16, 16)
+            self.camera   = env.Camera([0.0, -1.0, 2.0])
+            self.lights   = [env.Light([0.0, 0.0, 2.0], [50.0, 50.0, 50.0]), env.Light([1.0, 0.5, 1.5], [20.0, 10.0, 5.0]), env.Light([-1.0, 0.0, 1.0], [5.0, 5.0, 5.0])]
+            self.scene    = env.Scene
+            self.env      = env
+
+        def test_multiple_lights_batch(self):
+            rendering          = self.renderer.render(self.scene(self.camera, self.lights), self.svbrdf)
+            rendering_expected = sum(self.renderer.render(self.scene(self.camera, light), self.svbrdf) for light in self.lights)
+            self.assertEqual(rendering.shape, (2, 3, 16, 16))
+            torch.testing.assert_allclose(rendering, rendering_expected)
+
+        def test_multiple_lights_single(self):
+            rendering          = self.renderer.render(self.scene(self.camera, self.lights), self.svbrdf[0])
+            rendering_expected = sum(self.renderer.render(self.scene(self.camera, light), self.svbrdf[0]) for light in self.lights)
+            self.assertEqual(rendering.shape, (1, 3, 16, 16))
+            torch.testing.assert_allclose(rendering, rendering_expected)
+
+        def test_half_precision_input(self):
+            svbrdf             = self.svbrdf.half()
+            rendering          = self.renderer.render(self.scene(self.camera, self.lights), svbrdf)
+            rendering_expected = self.renderer.render(self.scene(self.camera, self.lights), svbrdf.float())
+            self.assertEqual(rendering.dtype, torch.float32)
+            torch.testing.assert_allclose(rendering, rendering_expected, rtol=1e-2, atol=1e-3)
+
+        def test_bfloat16_input(self):
+            svbrdf             = self.svbrdf.bfloat16()
+            rendering_expected = self.renderer.render(self.scene(self.camera, self.lights), svbrdf.float())
+            for renderer in [self.renderer, renderers.LocalRenderer(dtype=torch.bfloat16)]:
+                rendering = renderer.render(self.scene(self.camera, self.lights), svbrdf)
+                self.assertEqual(rendering.dtype, torch.float32)
+                torch.testing.assert_allclose(rendering, rendering_expected, rtol=5e-2, atol=1e-2)
+
+        @unittest.skipIf(renderers.numba is None, "Rendering with numba requires the numba package.")
+        def test_numba_kernel(self):
+            camera_positions = torch.tensor([[0.0, -1.0, 2.0], [0.5, 0.5, 1.0], [-1.0, 0.2, 0.5]])
+            light_positions  = torch.tensor([[0.0, 0.0, 2.0], [1.0, 0.5, 1.5], [-0.5, -0.5, 0.8]])
+            light_colors     = torch.tensor([[50.0, 50.0, 50.0], [20.0, 10.0, 5.0], [5.0, 5.0, 5.0]])
+
+            # Realistic materials with unit length normals and roughness down to zero
+            svbrdf       = self.svbrdf[0].clone()
+            svbrdf[0:3]  = torch.nn.functional.normalize(svbrdf[0:3] * 2.0 - 1.0 + torch.tensor([0.0, 0.0, 1.5]).view(3, 1, 1), dim=0)
+            svbrdf[6:9, 0] = 0.0
+
+            rendering          = renderers.render_local_numba(svbrdf, camera_positions, light_positions, light_colors)
+            rendering_expected = self.renderer.render(self.scene(self.env.Camera(camera_positions), self.env.Light(light_positions, light_colors)), svbrdf.unsqueeze(0))
+            self.assertEqual(rendering.shape, (3, 3, 16, 16))
+            torch.testing.assert_allclose(rendering, rendering_expected, rtol=1e-3, atol=1e-3)
+
+    class TestMaterialMixing(unittest.TestCase):
+        def setUp(self):
+            import dataset
+            import tempfile
+
+            # Mixing does not read any samples, so the dataset can be empty
+            self.data_directory = tempfile.TemporaryDirectory()
+            self.data           = dataset.SvbrdfDataset(self.data_directory.name, image_size=16, scale_mode='crop', input_image_count=0, used_input_image_count=0, use_augmentation=False)
+
+            # Materials with unit length normals in the upper hemisphere
+            self.svbrdfs_0 = torch.rand(4, 12, 16, 16)
+            self.svbrdfs_1 = torch.rand(4, 12, 16, 16)
+            for svbrdfs in [self.svbrdfs_0, self.svbrdfs_1]:
+                svbrdfs[:, 0:3] = torch.nn.functional.normalize(svbrdfs[:, 0:3] * 2.0 - 1.0 + torch.tensor([0.0, 0.0, 1.5]).view(3, 1, 1), dim=-3)
+            self.alpha = torch.empty((4, 1, 1, 1)).uniform_(0.1, 0.9)
+
+        def tearDown(self):
+            self.data_directory.cleanup()
+
+        def test_mix_batch(self):
+            svbrdfs          = self.data.mix(self.svbrdfs_0, self.svbrdfs_1, self.alpha)
+            svbrdfs_expected = torch.stack([self.data.mix(self.svbrdfs_0[i], self.svbrdfs_1[i], self.alpha[i]) for i in range(self.alpha.shape[0])])
+            self.assertEqual(svbrdfs.shape, (4, 12, 16, 16))
+            torch.testing.assert_allclose(svbrdfs, svbrdfs_expected)
+
+        def test_mix_normals(self):
+            normals, _, _, _ = unpack_svbrdf(self.data.mix(self.svbrdfs_0, self.svbrdfs_1, self.alpha))
+            torch.testing.assert_allclose(torch.linalg.vector_norm(normals, dim=-3), torch.ones(4, 16, 16))
+
+    class TestCropSquare(unittest.TestCase):
+        def setUp(self):
+            self.images = torch.rand(3, 12, 16, 20)
+            self.size   = 8
+
+        def test_crop_tuple_anchor(self):
+            crop = crop_square(self.images[0], (2, 5), self.size)
+            self.assertEqual(crop.shape, (12, self.size, self.size))
+            torch.testing.assert_allclose(crop, self.images[0, :, 2:10, 5:13])
+
+        def test_crop_tensor_anchor(self):
+            crop = crop_square(self.images, torch.tensor([4, 9]), self.size)
+            self.assertEqual(crop.shape, (3, 12, self.size, self.size))
+            torch.testing.assert_allclose(crop, self.images[:, :, 4:12, 9:17])
+
+        def test_crop_anchor_per_image(self):
+            anchors = torch.tensor([[0, 0], [8, 12], [3, 7]])
+            crop    = crop_square(self.images, anchors, self.size)
+            self.assertEqual(crop.shape, (3, 12, self.size, self.size))
+            for i, (y, x) in enumerate(anchors.tolist()):
+                torch.testing.assert_allclose(crop[i], self.images[i, :, y:y + self.size, x:x + self.size])
+
     #class TestSvbrdfPacking(unittest.TestCase):
 
     unittest.main()
\ No newline at end of file